@@ -1,16 +1,26 @@
 import streamlit as st
-from utils.api_client import PageSpeedInsightsAPI
+from utils.api_client import PageSpeedInsightsAPI, PSIError, PSIAuthError
 from utils.seo_analyzer import SEOAnalyzer
 from components.metrics_display import display_metrics
 from components.report_generator import generate_report
 from components.bulk_upload import render_upload_section
-import asyncio
-import re
+import concurrent.futures
+from urllib.parse import urlsplit, urlunsplit
 import traceback
 import pandas as pd
-import json
-from typing import List, Dict
+import orjson
+from typing import List, Dict, Tuple
 import io
+import math
+import string
+import openpyxl
+import xlsxwriter
+
+try:
+    import lxml  # noqa: F401 -- openpyxl only streams write-only workbooks with lxml
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
 
 # Page configuration
 st.set_page_config(
@@ -58,66 +68,140 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-@st.cache_data(ttl=3600)
-def validate_url(url):
+_HOST_LABEL_CHARS = frozenset(string.ascii_letters + string.digits + '-')
+
+
+def _valid_hostname(host: str) -> bool:
+    """Check each DNS label in a single linear pass (no regex backtracking)"""
+    # A single trailing dot marks a fully qualified name
+    name = host.removesuffix('.')
+    if not name or len(name) > 253:
+        return False
+    return all(
+        0 < len(label) <= 63
+        and not label.startswith('-') and not label.endswith('-')
+        and _HOST_LABEL_CHARS.issuperset(label)
+        for label in name.split('.')
+    )
+
+
+def validate_url(url: str) -> bool:
     """Validate URL format"""
-    pattern = re.compile(
-        r'^https?://'
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'
-        r'localhost|'
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
-        r'(?::\d+)?'
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return bool(pattern.match(url))
+    if not isinstance(url, str) or any(char.isspace() for char in url):
+        return False
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        port = parts.port  # Raises ValueError for a malformed or out-of-range port
+    except ValueError:
+        return False
+    if port is not None and not 0 < port < 65536:
+        return False
+    return (parts.scheme in ('http', 'https') and bool(host)
+            and ('.' in host or host == 'localhost') and _valid_hostname(host))
+
+
+def normalize_url(url: str) -> str:
+    """Strip whitespace and drop a bare root path, so https://x.com/ and https://x.com match"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    # Any other path, query or fragment is kept exactly as entered
+    if parts.path == '/' and not parts.query and not parts.fragment:
+        return urlunsplit(parts._replace(path=''))
+    return url
+
+
+def dedupe_urls(urls: List[str]) -> List[str]:
+    """Normalize URLs, then drop blanks and duplicates, preserving order"""
+    # Empty spreadsheet cells arrive as NaN/None; other non-string cells are kept as text for validation
+    normalized = (normalize_url(str(url)) for url in urls if not pd.isna(url))
+    return list(dict.fromkeys(url for url in normalized if url))
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def validate_many(urls: Tuple[str, ...]) -> Tuple[List[str], List[str]]:
+    """Split URLs into valid and invalid lists, cached by the URL list's contents"""
+    valid_urls, invalid_urls = [], []
+    for url in urls:
+        (valid_urls if validate_url(url) else invalid_urls).append(url)
+    return valid_urls, invalid_urls
 
 
-def analyze_url(api_client: PageSpeedInsightsAPI, url: str) -> Dict:
-    """Analyze a single URL"""
-    desktop_results = api_client.get_metrics(url, strategy="desktop")
-    mobile_results = api_client.get_metrics(url, strategy="mobile")
+STRATEGIES = ('desktop', 'mobile')
 
-    return {'url': url, 'desktop': desktop_results, 'mobile': mobile_results}
 
+def _fetch_one(api_client: PageSpeedInsightsAPI, url: str, strategy: str):
+    """Fetch one strategy in a worker thread, returning per-URL API errors instead of raising"""
+    try:
+        return api_client.get_metrics(url, strategy=strategy)
+    except PSIAuthError:
+        # A bad key fails every request, so let it abort the whole batch
+        raise
+    except PSIError as e:
+        return e
 
-def export_results(results: List[Dict], format: str):
-    """Export results in the specified format"""
+
+EXPORT_COLUMNS = {
+    'url': 'URL',
+    'desktop.lighthouse_result.categories.performance.score': 'Desktop Performance',
+    'desktop.lighthouse_result.categories.accessibility.score': 'Desktop Accessibility',
+    'desktop.lighthouse_result.categories.best-practices.score': 'Desktop Best Practices',
+    'desktop.lighthouse_result.categories.seo.score': 'Desktop SEO',
+    'mobile.lighthouse_result.categories.performance.score': 'Mobile Performance',
+    'mobile.lighthouse_result.categories.accessibility.score': 'Mobile Accessibility',
+    'mobile.lighthouse_result.categories.best-practices.score': 'Mobile Best Practices',
+    'mobile.lighthouse_result.categories.seo.score': 'Mobile SEO'
+}
+
+
+def _to_excel(df: pd.DataFrame) -> bytes:
+    """Write rows directly, bypassing pandas' per-cell ExcelFormatter"""
+    output = io.BytesIO()
+    # NaN is not a valid Excel cell value, so missing scores are written as 'N/A'
+    rows = (
+        tuple('N/A' if isinstance(value, float) and math.isnan(value) else value for value in row)
+        for row in df.itertuples(index=False, name=None)
+    )
+    if LXML_AVAILABLE:
+        # Write-only workbooks stream rows through lxml, keeping memory flat
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Analysis Results')
+        worksheet.append(df.columns.tolist())
+        for row in rows:
+            worksheet.append(row)
+        workbook.save(output)
+    else:
+        # constant_memory flushes each row as it is written, so avoid merged cells
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Analysis Results')
+        worksheet.write_row(0, 0, df.columns.tolist())
+        for row_num, row in enumerate(rows, start=1):
+            worksheet.write_row(row_num, 0, row)
+        workbook.close()
+    return output.getvalue()
+
+
+# Export payloads can be large, so keep only a few recent ones in memory
+@st.cache_data(ttl=3600, max_entries=3, show_spinner=False)
+def export_results(results: List[Dict], format: str) -> bytes:
+    """Export results in the specified format as bytes ready for download"""
     if format == 'json':
-        return json.dumps(results, indent=2)
+        return orjson.dumps(results, option=orjson.OPT_INDENT_2)
 
-    # Flatten results for CSV/Excel with safe score handling
-    flattened_data = []
-    for result in results:
-        def get_score(data, category):
-            try:
-                score = data['lighthouse_result']['categories'][category]['score']
-                if score is None:
-                    return 'N/A'
-                return score * 100 if score > 0 else 0
-            except (KeyError, TypeError):
-                return 'N/A'
-        
-        row = {
-            'URL': result['url'],
-            'Desktop Performance': get_score(result['desktop'], 'performance'),
-            'Desktop Accessibility': get_score(result['desktop'], 'accessibility'),
-            'Desktop Best Practices': get_score(result['desktop'], 'best-practices'),
-            'Desktop SEO': get_score(result['desktop'], 'seo'),
-            'Mobile Performance': get_score(result['mobile'], 'performance'),
-            'Mobile Accessibility': get_score(result['mobile'], 'accessibility'),
-            'Mobile Best Practices': get_score(result['mobile'], 'best-practices'),
-            'Mobile SEO': get_score(result['mobile'], 'seo')
-        }
-        flattened_data.append(row)
-
-    df = pd.DataFrame(flattened_data)
+    # Flatten results for CSV/Excel in a single normalize pass
+    df = pd.json_normalize(results, sep='.')
+    df = df.reindex(columns=list(EXPORT_COLUMNS)).rename(columns=EXPORT_COLUMNS)
+    # Keep scores numeric; missing values stay NaN and are written as 'N/A'
+    score_columns = df.columns[1:]
+    df[score_columns] = df[score_columns].astype('float64').clip(lower=0) * 100
 
     if format == 'csv':
-        return df.to_csv(index=False)
+        return df.to_csv(index=False, na_rep='N/A').encode()
     elif format == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Analysis Results', index=False)
-        return output.getvalue()
+        return _to_excel(df)
 
 
 def main():
@@ -158,34 +242,72 @@ def main():
     if single_url:
         urls = [single_url]
 
+    # Each duplicate would cost two more API calls, so drop them up front
+    urls = dedupe_urls(urls)
+
     # Centered submit button
     col1, col2, col3 = st.columns([1, 1, 1])
     with col2:
         analyze_button = st.button("🚀 Analyze Websites")
 
     if urls and analyze_button:
-        invalid_urls = [url for url in urls if not validate_url(url)]
+        urls, invalid_urls = validate_many(tuple(urls))
         if invalid_urls:
             st.error(f"Invalid URLs found: {', '.join(invalid_urls)}")
             return
 
         with st.spinner("🔍 Analyzing websites..."):
             try:
-                # Initialize API client with the provided API key
-                api_client = PageSpeedInsightsAPI(api_key=api_key)
-                all_results = []
-
-                progress_bar = st.progress(0)
-                for i, url in enumerate(urls):
-                    with st.expander(f"Analyzing {url}", expanded=True):
+                # Initialize API client with the provided API key; its connections
+                # are closed when the block exits, even if a fetch fails
+                with PageSpeedInsightsAPI(api_key=api_key) as api_client:
+                    progress_bar = st.progress(0)
+                    status = st.empty()
+                    # Only push progress to the front end about 20 times per run
+                    total_requests = len(urls) * len(STRATEGIES)
+                    update_every = max(1, total_requests // 20)
+                    # Fetch desktop and mobile for every URL concurrently over the shared
+                    # HTTP/2 connection; widgets are only rendered from the main thread
+                    fetched = [{'url': url} for url in urls]
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                        futures = {
+                            executor.submit(_fetch_one, api_client, url, strategy): (i, strategy)
+                            for i, url in enumerate(urls)
+                            for strategy in STRATEGIES
+                        }
                         try:
-                            result = analyze_url(api_client, url)
+                            for completed, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                                i, strategy = futures[future]
+                                try:
+                                    fetched[i][strategy] = future.result()
+                                except PSIAuthError:
+                                    # A bad key fails every request, so stop the whole batch
+                                    raise
+                                except Exception as e:
+                                    # Unexpected errors only fail this URL; keep the rest of the batch
+                                    fetched[i][strategy] = e
+                                if completed % update_every == 0 or completed == total_requests:
+                                    progress_bar.progress(completed / total_requests)
+                                    status.caption(f"Fetched {strategy} results for {urls[i]}")
+                        finally:
+                            # Streamlit stops or reruns the script by raising from st calls;
+                            # don't spend quota on queued requests nobody will see
+                            executor.shutdown(wait=False, cancel_futures=True)
+                status.empty()
+
+                # Render all results in one pass, in the order the URLs were submitted
+                all_results = []
+                for result in fetched:
+                    url = result['url']
+                    with st.expander(f"Results for {url}", expanded=True):
+                        errors = [result[strategy] for strategy in STRATEGIES if isinstance(result[strategy], Exception)]
+                        if errors:
+                            st.error(f"Error analyzing {url}: {str(errors[0])}")
+                            if not isinstance(errors[0], PSIError):
+                                st.exception(errors[0])
+                        else:
                             all_results.append(result)
-                            # Show individual results
                             display_metrics(result['desktop'], result['mobile'])
-                        except Exception as e:
-                            st.error(f"Error analyzing {url}: {str(e)}")
-                    progress_bar.progress((i + 1) / len(urls))
 
                 if all_results:
                     st.success(f"✅ Analysis completed for {len(all_results)} URLs")
@@ -221,16 +343,10 @@ def main():
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
 
+            except PSIAuthError:
+                st.error("⚠️ Invalid API Key: Please check your PageSpeed Insights API key and try again.")
             except Exception as e:
-                error_msg = str(e)
-                if "API key not found" in error_msg or "Invalid API key" in error_msg:
-                    st.error("⚠️ Invalid API Key: Please check your PageSpeed Insights API key and try again.")
-                elif "Failed to fetch metrics" in error_msg:
-                    st.error("🌐 Network Error: Unable to fetch data from Google PageSpeed Insights. Please try again later.")
-                elif "Invalid API response" in error_msg:
-                    st.error("🚫 API Error: Received invalid response from PageSpeed Insights. Please try again later.")
-                else:
-                    st.error(f"❌ An unexpected error occurred: {error_msg}")
+                st.error(f"❌ An unexpected error occurred: {str(e)}")
 
                 # Log the full error for debugging
                 with st.expander("Debug information"):
@@ -1,169 +1,204 @@
-import requests
+import httpx
+import orjson
 import streamlit as st
 import os
+import time
+import hashlib
+
+# Define a legitimate browser user agent
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Rate-limited and transient server errors are retried with exponential backoff
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+# Lighthouse runs routinely take tens of seconds
+REQUEST_TIMEOUT = 120.0
+
+# Disk-persisted caches ignore st.cache_data's ttl, so cached results carry
+# their fetch time and get_metrics evicts and refetches them once they are
+# older than this. Entries are replaced in place, so the disk cache holds at
+# most one file per (API key, URL, strategy); results for URLs that are never
+# requested again stay on disk until the cache is cleared.
+CACHE_TTL_SECONDS = 3600
+
+# Map every category key the API may return to our canonical key
+_CAT_ALIASES = {
+    'performance': 'performance',
+    'accessibility': 'accessibility',
+    'best-practices': 'best-practices',
+    'bestPractices': 'best-practices',
+    'seo': 'seo'
+}
+_CANONICAL = ('performance', 'accessibility', 'best-practices', 'seo')
+_DEFAULT_CATEGORY = {'score': 0}
+_DEFAULT_AUDIT = {'displayValue': 'N/A', 'score': 0}
+
+REQUIRED_AUDITS = (
+    'first-contentful-paint',
+    'interactive',
+    'largest-contentful-paint',
+    'cumulative-layout-shift',
+    'total-blocking-time',
+    'server-response-time',
+    'interaction-to-next-paint'
+)
+
+
+class PSIError(Exception):
+    """Base error for PageSpeed Insights requests"""
+
+
+class PSIAuthError(PSIError):
+    """The API key is missing, invalid or lacks permissions"""
+
+
+class PSINetworkError(PSIError):
+    """The request could not be completed"""
+
+
+class PSIResponseError(PSIError):
+    """The API rejected the request or returned an unusable response"""
+
 
 class PageSpeedInsightsAPI:
     def __init__(self, api_key=None):
         self.base_url = "https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
         self.api_key = api_key
         if not self.api_key:
-            raise Exception("API key not provided. Please provide a valid PageSpeed Insights API key.")
+            raise PSIAuthError("API key not provided. Please provide a valid PageSpeed Insights API key.")
+        # Short digest identifying the key in cache keys, so the key itself is never hashed or stored
+        self.api_key_hash = hashlib.blake2b(self.api_key.encode(), digest_size=8).hexdigest()
 
-        # Define a legitimate browser user agent
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        # Share one HTTP/2 connection across worker threads so concurrent
+        # requests are multiplexed instead of each opening a TCP/TLS connection
+        transport = httpx.HTTPTransport(
+            http2=True,
+            retries=MAX_RETRIES,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20)
+        )
+        self.client = httpx.Client(transport=transport, headers=HEADERS, timeout=REQUEST_TIMEOUT)
 
     @staticmethod
-    @st.cache_data(ttl=3600, show_spinner=False)
-    def _fetch_metrics(base_url: str, api_key: str, url: str, strategy: str = "desktop", headers: dict = None):
+    def _build_params(api_key: str, url: str, strategy: str) -> list:
         """
-        Cached function to fetch PageSpeed Insights metrics
+        Build query parameters, repeating 'category' for each requested category
         """
-        params = {
-            'url': url,
-            'strategy': strategy,
-            'category': ['performance', 'accessibility', 'best-practices', 'seo'],
-            'key': api_key
+        params = [('url', url), ('strategy', strategy), ('key', api_key)]
+        params.extend(('category', category) for category in _CANONICAL)
+        return params
+
+    @staticmethod
+    def _normalize_response(data: dict) -> dict:
+        """
+        Standardize a raw PageSpeed Insights response
+        """
+        # Check if we have the lighthouse results
+        if 'lighthouseResult' not in data:
+            raise PSIResponseError("Invalid API response: No lighthouse results found")
+
+        lighthouse = data['lighthouseResult']
+        categories = lighthouse['categories']
+
+        # Process categories with a single alias lookup and safe score handling
+        cats_out = {}
+        for alias, category_data in categories.items():
+            canonical = _CAT_ALIASES.get(alias)
+            if canonical and isinstance(category_data, dict):
+                score = category_data.get('score')
+                cats_out[canonical] = {'score': score if score is not None else 0}
+
+        for key in _CANONICAL:
+            if key not in cats_out:
+                # Set default score if category is missing
+                cats_out[key] = dict(_DEFAULT_CATEGORY)
+                print(f"Warning: Category '{key}' not found. Available: {', '.join(categories.keys())}")
+
+        # Process audits with safe handling in a single pass
+        audits = lighthouse.get('audits', {})
+        audits_out = {
+            key: {'displayValue': audit.get('displayValue', 'N/A'), 'score': audit.get('score') or 0}
+            if (audit := audits.get(key)) else dict(_DEFAULT_AUDIT)
+            for key in REQUIRED_AUDITS
         }
 
-        response = None
+        # Standardize the response format
+        return {'lighthouse_result': {'categories': cats_out, 'audits': audits_out}}
+
+    def _get(self, params: list) -> httpx.Response:
+        """
+        Send a request, retrying rate-limited and transient server errors
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.client.get(self.base_url, params=params)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+            time.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+    @st.cache_data(persist="disk", show_spinner=False, max_entries=5000)
+    def _fetch_metrics(_self, api_key_hash: str, url: str, strategy: str = "desktop"):
+        """
+        Cached function to fetch PageSpeed Insights metrics, persisted to disk
+        so results survive app restarts. The client itself is excluded from
+        the cache key, which identifies it by api_key_hash instead.
+        Returns a (fetched_at, result) pair so callers can expire stale entries.
+        """
+        params = _self._build_params(_self.api_key, url, strategy)
+
+        try:
+            response = _self._get(params)
+        except httpx.HTTPError as e:
+            raise PSINetworkError(f"Failed to fetch metrics: {str(e)}") from e
+
+        # Check for common API key errors
+        if response.status_code == 400:
+            try:
+                error_detail = orjson.loads(response.content).get('error', {}).get('message', '')
+            except ValueError:
+                error_detail = response.text
+            if 'API key not valid' in error_detail:
+                raise PSIAuthError("Invalid API key. Please check your PageSpeed Insights API key.")
+            raise PSIResponseError(f"Bad request: {error_detail}")
+        if response.status_code == 403:
+            raise PSIAuthError("API key error: Access forbidden. Please ensure your API key has the necessary permissions.")
+
         try:
-            response = requests.get(base_url, params=params, headers=headers)
             response.raise_for_status()
-            data = response.json()
-
-            # Check if we have the lighthouse results
-            if 'lighthouseResult' not in data:
-                raise Exception("Invalid API response: No lighthouse results found")
-
-            # Get categories with proper error handling
-            categories = data['lighthouseResult']['categories']
-
-            # Standardize the response format
-            result = {
-                'lighthouse_result': {
-                    'categories': {},
-                    'audits': {}
-                }
-            }
-
-            # Process categories with flexible key matching and safe score handling
-            category_keys = {
-                'performance': ['performance'],
-                'accessibility': ['accessibility'],
-                'best-practices': ['best-practices', 'bestPractices'],
-                'seo': ['seo']
-            }
-
-            for our_key, possible_keys in category_keys.items():
-                found = False
-                for api_key in possible_keys:
-                    if api_key in categories:
-                        # Safe score extraction
-                        category_data = categories[api_key]
-                        if category_data is None:
-                            score = None
-                        elif isinstance(category_data, dict) and 'score' in category_data:
-                            score = category_data['score']
-                        else:
-                            score = None
-                            
-                        result['lighthouse_result']['categories'][our_key] = {
-                            'score': score if score is not None else 0
-                        }
-                        found = True
-                        break
-                        
-                if not found:
-                    # Try alternative key formats
-                    kebab_key = our_key.replace('_', '-')
-                    camel_key = ''.join(word.capitalize() if i > 0 else word 
-                                      for i, word in enumerate(our_key.split('-')))
-                    
-                    if kebab_key in categories:
-                        category_data = categories[kebab_key]
-                        score = category_data.get('score', 0) if isinstance(category_data, dict) else 0
-                        result['lighthouse_result']['categories'][our_key] = {
-                            'score': score if score is not None else 0
-                        }
-                    elif camel_key in categories:
-                        category_data = categories[camel_key]
-                        score = category_data.get('score', 0) if isinstance(category_data, dict) else 0
-                        result['lighthouse_result']['categories'][our_key] = {
-                            'score': score if score is not None else 0
-                        }
-                    else:
-                        # Set default score if category is missing
-                        result['lighthouse_result']['categories'][our_key] = {
-                            'score': 0
-                        }
-                        print(f"Warning: Category '{our_key}' not found. Available: {', '.join(categories.keys())}")
-
-            # Process audits with safe handling
-            audits = data['lighthouseResult'].get('audits', {})
-            required_audits = [
-                'first-contentful-paint',
-                'interactive',
-                'largest-contentful-paint',
-                'cumulative-layout-shift',
-                'total-blocking-time',
-                'server-response-time',
-                'interaction-to-next-paint'
-            ]
-
-            for audit_key in required_audits:
-                if audit_key in audits and audits[audit_key] is not None:
-                    audit_data = audits[audit_key]
-                    result['lighthouse_result']['audits'][audit_key] = {
-                        'displayValue': audit_data.get('displayValue', 'N/A'),
-                        'score': audit_data.get('score', 0) if audit_data.get('score') is not None else 0
-                    }
-                else:
-                    result['lighthouse_result']['audits'][audit_key] = {
-                        'displayValue': 'N/A',
-                        'score': 0
-                    }
-
-            return result
-
-        except requests.exceptions.RequestException as e:
-            # Check for common API key errors
-            if response and response.status_code == 400:
-                error_detail = response.json().get('error', {}).get('message', '')
-                if 'API key not valid' in error_detail:
-                    raise Exception("Invalid API key. Please check your PageSpeed Insights API key.")
-                else:
-                    raise Exception(f"Bad request: {error_detail}")
-            elif response and response.status_code == 403:
-                raise Exception("API key error: Access forbidden. Please ensure your API key has the necessary permissions.")
-            else:
-                raise Exception(f"Failed to fetch metrics: {str(e)}")
-        except KeyError as e:
-            raise Exception(f"Invalid API response format: {str(e)}")
-        except Exception as e:
-            if "score" in str(e):
-                # If it's a score-related error, return a result with default values
-                print(f"Score error for {url}: {str(e)}")
-                return {
-                    'lighthouse_result': {
-                        'categories': {
-                            'performance': {'score': 0},
-                            'accessibility': {'score': 0},
-                            'best-practices': {'score': 0},
-                            'seo': {'score': 0}
-                        },
-                        'audits': {
-                            audit: {'displayValue': 'N/A', 'score': 0}
-                            for audit in required_audits
-                        }
-                    }
-                }
-            else:
-                raise Exception(f"An error occurred: {str(e)}")
+        except httpx.HTTPStatusError as e:
+            raise PSINetworkError(f"Failed to fetch metrics: {str(e)}") from e
+
+        try:
+            data = orjson.loads(response.content)
+        except ValueError as e:
+            raise PSIResponseError(f"Invalid API response: {str(e)}") from e
+
+        try:
+            return time.time(), _self._normalize_response(data)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PSIResponseError(f"Invalid API response format: {str(e)}") from e
 
     def get_metrics(self, url: str, strategy: str = "desktop"):
         """
         Public method to get PageSpeed Insights metrics
         """
-        return self._fetch_metrics(self.base_url, self.api_key, url, strategy, self.headers)
+        fetched_at, result = self._fetch_metrics(self.api_key_hash, url, strategy)
+        if time.time() - fetched_at > CACHE_TTL_SECONDS:
+            # Drop the stale entry from memory and disk, then fetch a fresh one
+            self._fetch_metrics.clear(self.api_key_hash, url, strategy)
+            fetched_at, result = self._fetch_metrics(self.api_key_hash, url, strategy)
+        return result
+
+    def close(self):
+        """
+        Close the underlying HTTP connections
+        """
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()